@@ -7,6 +7,7 @@ import pandas as pd
 import xcsv
 
 base = os.path.dirname(__file__)
+data_dir = os.path.join(base, 'data')
 
 def test_version():
     assert xcsv.__version__ == '0.5.0'
@@ -46,9 +47,12 @@ def dummy_data():
 def dummy_XCSV(dummy_metadata, dummy_data):
     return xcsv.XCSV(metadata=dummy_metadata, data=dummy_data)
 
-@pytest.fixture
+# Module-scoped fixtures are parsed once and shared by the tests in this
+# module, so they must be treated as read-only.  Tests that modify the
+# content (e.g. masking missing values) use function-scoped fixtures
+@pytest.fixture(scope='module')
 def short_test_data():
-    in_file = base + '/data/short-test-data.csv'
+    in_file = os.path.join(data_dir, 'short-test-data.csv')
 
     with xcsv.File(in_file) as f:
         content = f.read()
@@ -57,16 +61,16 @@ def short_test_data():
 
 @pytest.fixture
 def short_missing_value_test_data():
-    in_file = base + '/data/short-missing-value-test-data.csv'
+    in_file = os.path.join(data_dir, 'short-missing-value-test-data.csv')
 
     with xcsv.File(in_file) as f:
         content = f.read()
 
     return content
 
-@pytest.fixture
+@pytest.fixture(scope='module')
 def short_mislabelled_notes_test_data():
-    in_file = base + '/data/short-mislabelled-notes-test-data.csv'
+    in_file = os.path.join(data_dir, 'short-mislabelled-notes-test-data.csv')
 
     with xcsv.File(in_file) as f:
         content = f.read()
@@ -107,6 +111,11 @@ def test_parse_file_header_tokens_empty_parens():
     actual = xcsv.XCSV.parse_file_header_tokens(s)
     assert actual is None
 
+def test_parse_file_header_tokens_unclosed_parens():
+    s = 'a_value (some_units'
+    actual = xcsv.XCSV.parse_file_header_tokens(s)
+    assert actual is None
+
 def test_parse_column_header_tokens_full_dict():
     s = 'a_name (some_units) [a_note]'
     expected = {'name': 'a_name', 'units': 'some_units', 'notes': 'a_note'}
@@ -287,6 +296,16 @@ def test_rename_column_headers_as_labels(dummy_XCSV):
     f.rename_column_headers_as_labels()
     assert f.data.columns.to_list() == expected
 
+def test_rename_column_headers_preserves_index_name(dummy_XCSV):
+    f = dummy_XCSV
+    f.data.columns.name = 'cols'
+    f.rename_column_headers_as_names()
+    assert f.data.columns.to_list() == ['time', 'depth']
+    assert f.data.columns.name == 'cols'
+    f.rename_column_headers_as_labels()
+    assert f.data.columns.to_list() == ['time (year) [a]', 'depth (m)']
+    assert f.data.columns.name == 'cols'
+
 def test_rename_column_headers_as_names_uninitialised():
     f = xcsv.XCSV()
 
@@ -449,7 +468,7 @@ def test_get_notes_for_column_header(short_mislabelled_notes_test_data, key, exp
 
 def test_read_short_test_data(dummy_XCSV, short_test_data):
     assert short_test_data.metadata == dummy_XCSV.metadata
-    assert short_test_data.data.all().all() == dummy_XCSV.data.all().all()
+    pd.testing.assert_frame_equal(short_test_data.data, dummy_XCSV.data)
 
 def test_read_header():
     s = """# id: 1
@@ -530,6 +549,19 @@ def test_read_header_continuation_repeated_key_form():
     header = f.read_header()
     assert header == expected
 
+def test_read_header_continuation_leading_comment_char():
+    # Only the comment prefix is removed, so a value can begin with the
+    # comment character
+    s = """# id: 1
+# summary: This dataset...
+# #2 in the series.
+"""
+    fp = io.StringIO(s)
+    f = xcsv.Reader(fp=fp)
+    expected = {'id': '1', 'summary': ['This dataset...','#2 in the series.']}
+    header = f.read_header()
+    assert header == expected
+
 def test_read_header_no_value():
     s = """# id:
 """
@@ -539,6 +571,44 @@ def test_read_header_no_value():
     header = f.read_header()
     assert header == expected
 
+@pytest.mark.parametrize(['s'], [
+# A header value with a comma followed by an unbalanced quote mustn't open
+# a quoted field that swallows the following lines
+("""# id: 1
+# note: see x,"y
+# comment: z"
+# title: t
+time (s),depth (m)
+1,2
+3,4
+""",),
+("""# title: a,"b
+time (s),depth (m)
+1,2
+3,4
+""",),
+])
+def test_read_header_value_with_quote(s):
+    fp = io.StringIO(s)
+    f = xcsv.Reader(fp=fp)
+    content = f.read()
+    expected = pd.DataFrame({'time (s)': [1,3], 'depth (m)': [2,4]})
+    pd.testing.assert_frame_equal(content.data, expected)
+
+def test_read_unparseable_column_header():
+    # A column header that doesn't match the pattern is kept as a plain name
+    s = """# id: 1
+(units),b (m)
+1,2
+"""
+    fp = io.StringIO(s)
+    f = xcsv.Reader(fp=fp)
+    content = f.read()
+    expected = {'(units)': {'name': '(units)'}, 'b (m)': {'name': 'b', 'units': 'm', 'notes': None}}
+    assert content.metadata['column_headers'] == expected
+    content.rename_column_headers_as_names()
+    assert list(content.data.columns) == ['(units)', 'b']
+
 def test_set_header_key_value():
     f = xcsv.Reader()
     key, value = 'summary', 'This dataset...'
@@ -621,6 +691,20 @@ def test_mask_missing_values(short_missing_value_test_data, missing_value, expec
     f.mask_missing_values()
     pd.testing.assert_frame_equal(f.data, expected, check_dtype=False)
 
+# Nullable dtypes compare their missing entries as pd.NA
+@pytest.mark.parametrize(['missing_value','values','expected','dtype'], [
+('-999', [1, None, -999], [1, None, None], 'Int64'),
+('-999.99', [1.5, None, -999.99], [1.5, None, None], 'Float64'),
+('NA', ['a', None, 'NA'], ['a', None, None], 'string'),
+])
+def test_mask_missing_values_nullable_dtype(missing_value, values, expected, dtype):
+    f = xcsv.Reader()
+    f.data = pd.DataFrame({'depth (m)': pd.array(values, dtype=dtype)})
+    f.header = {xcsv.XCSV.DEFAULTS['missing_value_key']: missing_value}
+    f.mask_missing_values()
+    expected = pd.DataFrame({'depth (m)': pd.array(expected, dtype=dtype)})
+    pd.testing.assert_frame_equal(f.data, expected)
+
 @pytest.mark.parametrize(['missing_value','label', 'idx'], [
 ('-999.99', 'depth (m)', 5),
 ('-999', 'depth (m)', 3),
@@ -671,44 +755,33 @@ def test_reconstruct_header_lines_escaped_list_item_custom_delimiter():
     actual = '\n'.join(f.reconstruct_header_lines('# ', '/ ')) + '\n'
     assert actual == expected
 
-@pytest.mark.parametrize(['path','opts','expected'], [
-('/data/encoded_ascii.csv', {'encoding': 'ASCII'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_ascii.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_iso-8859-15.csv', {'encoding': 'ISO-8859-15'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_ascii.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {}, {'id': '123', 'title': 'The title'}),
-])
+ENCODED_TEST_CASES = [
+('encoded_ascii.csv', {'encoding': 'ASCII'}, {'id': '123', 'title': 'The title'}),
+('encoded_ascii.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
+('encoded_iso-8859-15.csv', {'encoding': 'ISO-8859-15'}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
+('encoded_ascii.csv', {}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8.csv', {}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_bom.csv', {}, {'id': '123', 'title': 'The title'}),
+('encoded_utf-8_header_and_data_bom.csv', {}, {'id': '123', 'title': 'The title'}),
+]
+
+@pytest.mark.parametrize(['path','opts','expected'], ENCODED_TEST_CASES)
 def test_read_header_handling_bom(path, opts, expected):
-    in_file = base + path
+    in_file = os.path.join(data_dir, path)
 
     with open(in_file, **opts) as fp:
         f = xcsv.Reader(fp=fp)
         header = f.read_header()
         assert header == expected
 
-@pytest.mark.parametrize(['path','opts','expected'], [
-('/data/encoded_ascii.csv', {'encoding': 'ASCII'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_ascii.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_iso-8859-15.csv', {'encoding': 'ISO-8859-15'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {'encoding': 'UTF-8-SIG'}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_ascii.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_bom.csv', {}, {'id': '123', 'title': 'The title'}),
-('/data/encoded_utf-8_header_and_data_bom.csv', {}, {'id': '123', 'title': 'The title'}),
-])
+@pytest.mark.parametrize(['path','opts','expected'], ENCODED_TEST_CASES)
 def test_read_handling_bom(path, opts, expected):
-    in_file = base + path
+    in_file = os.path.join(data_dir, path)
 
     with xcsv.File(in_file, **opts) as f:
         content = f.read()
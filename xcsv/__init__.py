@@ -8,14 +8,36 @@
 __version__ = '0.5.0'
 
 import re
+import sys
 import argparse
 import codecs
 import encodings
+import functools
 
 import pandas as pd
 
 UTF_8_BOM = codecs.BOM_UTF8.decode('utf-8')
 
+FILE_HEADER_PATTERN = r'(?P<value>.+)\s+\((?P<units>.+)\)$'
+
+COLUMN_HEADER_PATTERN = r'(?P<name>[^][)(]+)(?:\s+\((?P<units>.+)\))?(?:\s+\[(?P<notes>.+)\])?$'
+
+# Column headers containing none of these characters are a plain name
+COLUMN_HEADER_DELIMITERS = frozenset('()[]')
+
+@functools.lru_cache(maxsize=None)
+def _compile_pattern(pattern):
+    """
+    Compile the given regular expression, caching the compiled pattern
+
+    :param pattern: The regular expression
+    :type pattern: str
+    :returns: The compiled regular expression
+    :rtype: re.Pattern
+    """
+
+    return re.compile(pattern)
+
 def _parse_tokens(s, pattern):
     """
     Parse tokens from the given string
@@ -23,13 +45,17 @@ def _parse_tokens(s, pattern):
     :param s: The string containing parseable tokens
     :type s: str
     :param pattern: The regular expression to parse tokens from the string
-    :type pattern: str
+    :type pattern: str or re.Pattern
     :returns: The parsed tokens or None if no matches were found
     :rtype: dict or None
     """
 
     tokens = None
-    matches = re.search(pattern, s)
+
+    if isinstance(pattern, str):
+        pattern = _compile_pattern(pattern)
+
+    matches = pattern.search(s)
 
     if matches:
         tokens = matches.groupdict()
@@ -47,16 +73,36 @@ def _strip_tokens(tokens):
     """
 
     if tokens:
-        for key in tokens:
+        for key, value in tokens.items():
             # If the RE pattern failed to match an optional component,
             # e.g. 'notes', then it will be None and so have no strip()
-            try:
-                tokens[key] = tokens[key].strip()
-            except AttributeError:
-                pass
+            if value is not None:
+                tokens[key] = value.strip()
 
     return tokens
 
+@functools.lru_cache(maxsize=4096)
+def _parse_header_tokens(s, pattern):
+    """
+    Parse and strip tokens from the given header string, caching the result
+
+    This is intended for column headers, which are typically repeated across
+    files of the same format.  As the cache is shared, the tokens are
+    returned as an immutable tuple of (key, value) pairs, which callers
+    should convert to a new dict
+
+    :param s: The string containing parseable tokens
+    :type s: str
+    :param pattern: The regular expression to parse tokens from the string
+    :type pattern: str
+    :returns: The parsed tokens or None if no matches were found
+    :rtype: tuple or None
+    """
+
+    tokens = _strip_tokens(_parse_tokens(s, pattern))
+
+    return tuple(tokens.items()) if tokens is not None else None
+
 def _get_type_cast_value(str_value):
     """
     Cast a string representation of the given value to the most
@@ -68,7 +114,13 @@ def _get_type_cast_value(str_value):
     :rtype: One of [int, float, str]
     """
 
-    for func in [int, float]:
+    # int() never accepts a decimal point, so go straight to float()
+    if isinstance(str_value, str) and '.' in str_value:
+        funcs = [float]
+    else:
+        funcs = [int, float]
+
+    for func in funcs:
         try:
             cast_value = func(str_value)
             return cast_value
@@ -85,11 +137,11 @@ class XCSV(object):
     DEFAULTS = {
         'file_header_keys': ['value', 'units'],
         'file_header_default_key': 'value',
-        'file_header_pattern': r'(?P<value>.+)\s+\((?P<units>.+)\)$',
+        'file_header_pattern': FILE_HEADER_PATTERN,
         'file_header_templates': ['{value}', '({units})'],
         'column_header_keys': ['name', 'units', 'notes'],
         'column_header_default_key': 'name',
-        'column_header_pattern': r'(?P<name>[^][)(]+)(\s+\((?P<units>.+)\))?(\s+\[(?P<notes>.+)\])?$',
+        'column_header_pattern': COLUMN_HEADER_PATTERN,
         'column_header_templates': ['{name}', '({units})', '[{notes}]'],
         'missing_value_key': 'missing_value'
     }
@@ -112,10 +164,18 @@ class XCSV(object):
         """
         Parse value and units from the given file header value string
         See `cls.DEFAULTS['file_header_pattern']` and `_parse_tokens()`
+
+        When using the default pattern, a value that contains no closing
+        units delimiter can't have units, so the regular expression is
+        bypassed
         """
 
         pattern = cls.DEFAULTS['file_header_pattern']
 
+        if pattern == FILE_HEADER_PATTERN and ')' not in s:
+            return None
+
+        # File header values are mostly unique, so aren't worth caching
         return _strip_tokens(_parse_tokens(s, pattern))
 
     @classmethod
@@ -123,11 +183,20 @@ class XCSV(object):
         """
         Parse name, units and notes from the given column header string
         See `cls.DEFAULTS['column_header_pattern']` and `_parse_tokens()`
+
+        When using the default pattern, a column header that contains no
+        units or notes delimiters is just a name, so the regular expression
+        is bypassed
         """
 
         pattern = cls.DEFAULTS['column_header_pattern']
 
-        return _strip_tokens(_parse_tokens(s, pattern))
+        if s and pattern == COLUMN_HEADER_PATTERN and COLUMN_HEADER_DELIMITERS.isdisjoint(s):
+            return {'name': s.strip(), 'units': None, 'notes': None}
+
+        tokens = _parse_header_tokens(s, pattern)
+
+        return dict(tokens) if tokens is not None else None
 
     @classmethod
     def _get_list_header_exception_context(cls, l):
@@ -171,15 +240,9 @@ class XCSV(object):
         as it would have appeared in the original file.
         """
 
-        template_components = []
-
-        for key, tmpl in zip(keys, templates):
-            if key in d and d[key] is not None:
-                template_components.append(tmpl)
+        template = sep.join([tmpl for key, tmpl in zip(keys, templates) if d.get(key) is not None])
 
-        template = sep.join(template_components)
-
-        return template.format(**d)
+        return template.format_map(d)
 
     @classmethod
     def reconstruct_file_header_string(cls, d):
@@ -207,13 +270,9 @@ class XCSV(object):
         :rtype: dict
         """
 
-        col_map = {}
         def_key = self.DEFAULTS['column_header_default_key']
 
-        for key in self.metadata['column_headers']:
-            col_map[key] = self.metadata['column_headers'][key][def_key]
-
-        return col_map
+        return {key: value[def_key] for key, value in self.metadata['column_headers'].items()}
 
     def get_column_header_label_map(self):
         """
@@ -223,13 +282,25 @@ class XCSV(object):
         :rtype: dict
         """
 
-        col_map = {}
         def_key = self.DEFAULTS['column_header_default_key']
 
-        for key in self.metadata['column_headers']:
-            col_map[self.metadata['column_headers'][key][def_key]] = key
+        return {value[def_key]: key for key, value in self.metadata['column_headers'].items()}
+
+    def _rename_column_headers(self, col_map):
+        """
+        Rename the data column headers according to the given column map
+
+        Any column header not in the column map is left as-is.  The new
+        column headers are mapped directly, rather than via
+        `pandas.DataFrame.rename()`, to avoid its per-call overhead.
+        Mapping the existing index preserves its metadata, e.g. its name
+
+        :param col_map: The column map
+        :type col_map: dict
+        """
 
-        return col_map
+        if col_map:
+            self.data.columns = self.data.columns.map(lambda col: col_map.get(col, col))
 
     def rename_column_headers_as_names(self):
         """
@@ -237,7 +308,7 @@ class XCSV(object):
         """
 
         col_map = self.get_column_header_name_map()
-        self.data.rename(columns=col_map, inplace=True)
+        self._rename_column_headers(col_map)
 
     def rename_column_headers_as_labels(self):
         """
@@ -245,7 +316,7 @@ class XCSV(object):
         """
 
         col_map = self.get_column_header_label_map()
-        self.data.rename(columns=col_map, inplace=True)
+        self._rename_column_headers(col_map)
 
     def get_metadata_item(self, key, section='header', default=None):
         """
@@ -452,20 +523,20 @@ class Reader(object):
         """
 
         if key in self.header:
-            if isinstance(self.header[key], list):
-                self.header[key].append(value)
+            prev_value = self.header[key]
+
+            if isinstance(prev_value, list):
+                prev_value.append(value)
             else:
-                prev_value = self.header[key]
                 self.header[key] = [prev_value, value]
-        else:
-            self.header[key] = value
 
-        # A value/units dict isn't supported in a list header item, so if
-        # we've just added one, raise an exception
-        if isinstance(self.header[key], list):
+            # A value/units dict isn't supported in a list header item, so if
+            # we've just added one, raise an exception
             if isinstance(value, dict):
                 note = XCSV._get_list_header_exception_context(self.header[key])
                 raise TypeError(note)
+        else:
+            self.header[key] = value
 
     def read_header(self, comment='#', delimiter=':', parse_metadata=True):
         """
@@ -513,30 +584,37 @@ class Reader(object):
         key, value = None, None
         self.fp.seek(0, 0)
 
-        for i, line in enumerate(self.fp):
-            # UTF-8 encoded text may begin with an unnecessary BOM so skip it
-            if i == 0 and self.fp.encoding and encodings.normalize_encoding(self.fp.encoding.lower()) == encodings.normalize_encoding('utf-8'):
+        # UTF-8 encoded text may begin with an unnecessary BOM so skip it.
+        # This only applies to the first line, so is checked once
+        check_bom = bool(self.fp.encoding) and encodings.normalize_encoding(self.fp.encoding.lower()) == encodings.normalize_encoding('utf-8')
+
+        for line in self.fp:
+            if check_bom:
+                check_bom = False
+
                 if line.startswith(UTF_8_BOM):
                     line = line[len(UTF_8_BOM):]
 
             if line.startswith(comment):
-                try:
-                    left, right = line.split(delimiter, maxsplit=1)
-                except ValueError as e:
+                pos = line.find(delimiter)
+
+                if pos < 0:
                     # Value but no key: continuation of previous key
                     if key:
-                        value = line.strip().lstrip(comment + ' ')
+                        value = line[len(comment):].strip()
                     else:
-                        raise
+                        raise ValueError(f"Continuation line without a previous header key: {line.strip()}")
                 else:
-                    left = left.strip().lstrip(comment + ' ')
+                    left = line[len(comment):pos].strip()
 
                     # If left is empty it's an escaped continuation of
-                    # previous key, otherwise it's a normal key/value pair
+                    # previous key, otherwise it's a normal key/value pair.
+                    # Keys are interned as they're typically repeated across
+                    # files, e.g. when reading many files of the same format
                     if left:
-                        key = left
+                        key = sys.intern(left)
 
-                    value = right.strip()
+                    value = line[pos + len(delimiter):].strip()
 
                 if parse_metadata:
                     tokens = XCSV.parse_file_header_tokens(value)
@@ -585,16 +663,11 @@ class Reader(object):
 
         def_key = XCSV.DEFAULTS['column_header_default_key']
 
-        for col in self.data.columns:
-            if parse_metadata:
-                tokens = XCSV.parse_column_header_tokens(col)
-
-                try:
-                    self.column_headers[col] = tokens
-                except KeyError:
-                    pass
-            else:
-                self.column_headers[col] = {def_key: col}
+        if parse_metadata:
+            # A column header that can't be parsed is stored as a plain name
+            self.column_headers.update({col: XCSV.parse_column_header_tokens(col) or {def_key: col} for col in self.data.columns})
+        else:
+            self.column_headers.update({col: {def_key: col} for col in self.data.columns})
 
         return self.column_headers
 
@@ -646,7 +719,24 @@ class Reader(object):
         missing_value = self._get_type_cast_missing_value()
 
         if missing_value is not None:
-            self.data.mask(self.data == missing_value, inplace=True)
+            # A numeric missing value can only match numeric columns, and a
+            # string missing value can only match non-numeric columns, so
+            # avoid comparing it element-wise against any other columns
+            if isinstance(missing_value, (int, float)):
+                cols = self.data.select_dtypes(include='number').columns
+            elif isinstance(missing_value, str):
+                cols = self.data.select_dtypes(exclude='number').columns
+            else:
+                cols = self.data.columns
+
+            matches = self.data[cols] == missing_value
+
+            # Only rewrite those columns that contain the missing value.
+            # Nullable dtypes compare NA as NA, which any() skips
+            cols = cols[matches.any().to_numpy(dtype=bool)]
+
+            if len(cols) > 0:
+                self.data[cols] = self.data[cols].mask(matches[cols])
 
         return self.data
 
@@ -731,7 +821,7 @@ class Writer(object):
         :rtype: str
         """
 
-        return '{}{}{}{}'.format(comment, key, delimiter, value)
+        return f'{comment}{key}{delimiter}{value}'
 
     def header_value_as_string(self, value):
         """
@@ -769,26 +859,24 @@ class Writer(object):
         """
 
         header_lines = []
+        escape_needle = delimiter.strip()
 
         for key, value in self.header.items():
             if isinstance(value, list):
                 # This header item is made up of a key and continuation lines
-                for i, element in enumerate(value):
-                    if i == 0:
-                        line = self.format_header_line(comment, key, delimiter, self.header_value_as_string(element))
-                    else:
-                        # If the value contains the delimiter, then we have
-                        # to create an escaped continuation line, e.g.
-                        # # : The continuation value: <- with delimiter
-                        value_str = self.header_value_as_string(element)
-                        cont_key = ''
-                        cont_delimiter = delimiter if delimiter.strip() in value_str else ''
-                        line = self.format_header_line(comment, cont_key, cont_delimiter, value_str)
-
-                    header_lines.append(line)
+                if value:
+                    header_lines.append(self.format_header_line(comment, key, delimiter, self.header_value_as_string(value[0])))
+
+                for element in value[1:]:
+                    # If the value contains the delimiter, then we have
+                    # to create an escaped continuation line, e.g.
+                    # # : The continuation value: <- with delimiter
+                    value_str = self.header_value_as_string(element)
+                    cont_key = ''
+                    cont_delimiter = delimiter if escape_needle in value_str else ''
+                    header_lines.append(self.format_header_line(comment, cont_key, cont_delimiter, value_str))
             else:
-                line = self.format_header_line(comment, key, delimiter, self.header_value_as_string(value))
-                header_lines.append(line)
+                header_lines.append(self.format_header_line(comment, key, delimiter, self.header_value_as_string(value)))
 
         return header_lines
 
@@ -809,8 +897,8 @@ class Writer(object):
         :rtype: dict
         """
 
-        for line in self.reconstruct_header_lines(comment, delimiter):
-            self.fp.write(f'{line}\n')
+        header_lines = self.reconstruct_header_lines(comment, delimiter)
+        self.fp.write(''.join([f'{line}\n' for line in header_lines]))
 
         return self.header
 
@@ -863,6 +951,7 @@ class File(object):
     DEFAULTS = {
         'file_encoding': 'utf-8',
         'suffix': '.csv',
+        'buffer_size': 1024 * 1024,
     }
 
     def __init__(self, path=None, **kwargs):
@@ -925,7 +1014,9 @@ class File(object):
         if path:
             self.path = path
 
-        self.fp = open(self.path, mode, encoding=encoding)
+        # A larger buffer than the io default reduces the number of reads
+        # for the line-by-line header scan and pandas' chunked data read
+        self.fp = open(self.path, mode, buffering=self.DEFAULTS['buffer_size'], encoding=encoding)
 
         return self
 